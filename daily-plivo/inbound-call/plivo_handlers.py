@@ -5,31 +5,115 @@ This file contains the webhook handlers needed for Plivo to properly
 connect calls to the Daily SIP endpoint.
 """
 
+import json
+from functools import lru_cache
+from xml.sax.saxutils import escape, quoteattr
+from cachetools import TTLCache
 from fastapi import Request
-from fastapi.responses import PlainTextResponse
-import xml.etree.ElementTree as ET
+from fastapi.responses import Response
+from loguru import logger
 
 
-# In-memory storage for call mapping (use Redis or database in production)
-call_to_sip_mapping = {}
+def speak_and_hangup_xml(message: str) -> bytes:
+    """
+    Build Plivo XML that reads a message to the caller and hangs up.
+    """
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Speak>{message}</Speak>
+    <Hangup/>
+</Response>""".encode()
+
 
+# Static responses are encoded once at import instead of on every request
+CONNECT_ERROR_XML = speak_and_hangup_xml("Sorry, there was an error connecting your call.")
+FALLBACK_XML = speak_and_hangup_xml(
+    "We're sorry, but we're unable to connect your call at this time. Please try again later."
+)
 
-def store_call_mapping(call_id: str, sip_uri: str, phone_number: str):
+# Dial XML that connects the call to a SIP URI
+DIAL_XML_TEMPLATE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Dial callerId=%b timeout="30">
+        <User>%b</User>
+    </Dial>
+</Response>"""
+
+
+def build_dial_xml(caller_id: str, sip_uri: str) -> bytes:
+    """
+    Build the Plivo XML that dials a SIP URI, ready to use as a response body.
+    """
+    return DIAL_XML_TEMPLATE % (
+        quoteattr(caller_id or "").encode(),
+        escape(sip_uri).encode()
+    )
+
+
+# Call mappings live in Redis so they survive restarts and are shared
+# between uvicorn workers. Entries expire on their own if Plivo never
+# sends the hangup webhook.
+CALL_MAPPING_TTL = 3600
+
+# Without Redis (redis=None) mappings are kept in process memory, which
+# only works with a single worker. The cache is bounded so that entries
+# whose hangup webhook never arrives can't grow it forever.
+call_to_sip_mapping = TTLCache(maxsize=10000, ttl=CALL_MAPPING_TTL)
+
+
+def _call_key(key: str) -> str:
+    return f"call:{key}"
+
+
+@lru_cache(maxsize=4096)
+def normalize_phone(phone_number: str):
+    """
+    Normalize a phone number for use as a mapping key (strip the leading +).
+    """
+    return phone_number.lstrip('+') if phone_number else phone_number
+
+
+async def store_call_mapping(redis, call_id: str, sip_uri: str, phone_number: str):
     """
     Store the mapping between call ID and SIP URI.
-    In production, use a database or Redis for this.
     """
-    call_to_sip_mapping[call_id] = {
-        "sip_uri": sip_uri,
-        "phone_number": phone_number
-    }
+    if redis is None:
+        call_to_sip_mapping[call_id] = {
+            "sip_uri": sip_uri,
+            "phone_number": phone_number
+        }
+        return
+    
+    await redis.setex(
+        _call_key(call_id),
+        CALL_MAPPING_TTL,
+        json.dumps({
+            "sip_uri": sip_uri,
+            "phone_number": phone_number
+        })
+    )
 
 
-def get_call_mapping(call_uuid: str):
+async def get_call_mapping(redis, call_uuid: str):
     """
     Retrieve the mapping for a call.
     """
-    return call_to_sip_mapping.get(call_uuid)
+    if redis is None:
+        return call_to_sip_mapping.get(call_uuid)
+    
+    value = await redis.get(_call_key(call_uuid))
+    return json.loads(value) if value else None
+
+
+async def delete_call_mapping(redis, call_uuid: str):
+    """
+    Remove the mapping for a call.
+    """
+    if redis is None:
+        call_to_sip_mapping.pop(call_uuid, None)
+        return
+    
+    await redis.delete(_call_key(call_uuid))
 
 
 # Add these endpoints to your FastAPI app
@@ -53,88 +137,42 @@ async def plivo_answer_handler(request: Request):
         
         # Also check for call_id in query parameters (we pass it in the URL)
         call_id = request.query_params.get("call_id")
+        redis = request.app.state.redis
         
-        print(f"=== Plivo Answer Webhook ===")
-        print(f"CallUUID: {call_uuid}")
-        print(f"CallID (query): {call_id}")
-        print(f"From: {from_number}")
-        print(f"To: {to_number}")
-        print(f"Status: {call_status}")
-        print(f"All form data: {dict(form_data)}")
-        print(f"All mappings in storage: {call_to_sip_mapping}")
-        print(f"Mapping keys: {list(call_to_sip_mapping.keys())}")
-        
-        # Retrieve the SIP URI for this call (try call_id first, then call_uuid, then phone number)
-        mapping = None
+        logger.info(
+            "Plivo answer webhook - CallUUID: {}, CallID (query): {}, From: {}, To: {}, Status: {}",
+            call_uuid, call_id, from_number, to_number, call_status
+        )
+        # loguru only formats the FormData when debug logging is enabled
+        logger.debug("All form data: {}", form_data)
         
-        # Try by call_id (from query params)
-        if call_id:
-            mapping = get_call_mapping(call_id)
-            print(f"Tried call_id '{call_id}', mapping: {mapping}")
-        
-        # Try by call_uuid (from Plivo webhook)
-        if not mapping and call_uuid:
-            mapping = get_call_mapping(call_uuid)
-            print(f"Tried call_uuid '{call_uuid}', mapping: {mapping}")
-        
-        # Try by phone number (to_number from webhook) - with and without +
-        if not mapping and to_number:
-            mapping = get_call_mapping(to_number)
-            print(f"Tried phone number '{to_number}', mapping: {mapping}")
-            
-            if not mapping:
-                to_no_plus = to_number.lstrip('+')
-                mapping = get_call_mapping(to_no_plus)
-                print(f"Tried phone number without + '{to_no_plus}', mapping: {mapping}")
-        
-        # Last resort: search by phone number in values
-        if not mapping:
-            print(f"Searching all mappings by phone number...")
-            for key, value in call_to_sip_mapping.items():
-                stored_phone = value.get("phone_number", "")
-                print(f"  Checking key '{key}' -> phone '{stored_phone}' vs '{to_number}'")
-                if stored_phone == to_number or stored_phone == to_number.lstrip('+') or stored_phone.lstrip('+') == to_number:
-                    mapping = value
-                    print(f"Found mapping by searching phone number in values: key='{key}'")
-                    break
+        # Retrieve the SIP URI for this call: try call_id (query params) first,
+        # then call_uuid (Plivo webhook), then the normalized phone number.
+        # Stops at the first lookup that finds a mapping.
+        mapping = (
+            (await get_call_mapping(redis, call_id) if call_id else None)
+            or (await get_call_mapping(redis, call_uuid) if call_uuid else None)
+            or (await get_call_mapping(redis, normalize_phone(to_number)) if to_number else None)
+        )
         
         if not mapping:
             # If we don't have the mapping, return an error response
-            print(f"ERROR: No mapping found for call. CallUUID: {call_uuid}, CallID: {call_id}")
-            print(f"Available mappings: {list(call_to_sip_mapping.keys())}")
-            print(f"All mappings: {call_to_sip_mapping}")
-            error_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, there was an error connecting your call.</Speak>
-    <Hangup/>
-</Response>"""
-            return PlainTextResponse(error_xml, media_type="application/xml")
+            logger.error("No mapping found for call. CallUUID: {}, CallID: {}", call_uuid, call_id)
+            return Response(content=CONNECT_ERROR_XML, media_type="application/xml")
         
         sip_uri = mapping["sip_uri"]
-        print(f"Using SIP URI: {sip_uri}")
+        logger.debug("Using SIP URI: {}", sip_uri)
         
         # Create Plivo XML to connect to Daily's SIP endpoint
         # Using the <User> element to dial a SIP URI
-        xml_response = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Dial callerId="{from_number}" timeout="30">
-        <User>{sip_uri}</User>
-    </Dial>
-</Response>"""
+        xml_response = build_dial_xml(from_number, sip_uri)
         
-        print(f"Returning XML: {xml_response}")
-        return PlainTextResponse(xml_response, media_type="application/xml")
+        logger.opt(lazy=True).debug("Returning XML: {}", xml_response.decode)
+        return Response(content=xml_response, media_type="application/xml")
     except Exception as e:
-        import traceback
-        error_msg = f"Error in plivo_answer_handler: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
+        logger.exception("Error in plivo_answer_handler: {}", e)
         # Return a valid XML response even on error
-        error_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, there was an error connecting your call.</Speak>
-    <Hangup/>
-</Response>"""
-        return PlainTextResponse(error_xml, media_type="application/xml")
+        return Response(content=CONNECT_ERROR_XML, media_type="application/xml")
 
 
 async def plivo_hangup_handler(request: Request):
@@ -148,11 +186,11 @@ async def plivo_hangup_handler(request: Request):
     hangup_cause = form_data.get("HangupCause")
     duration = form_data.get("Duration")
     
-    print(f"Call ended - CallUUID: {call_uuid}, Cause: {hangup_cause}, Duration: {duration}s")
+    logger.info("Call ended - CallUUID: {}, Cause: {}, Duration: {}s", call_uuid, hangup_cause, duration)
     
     # Clean up the mapping
-    if call_uuid in call_to_sip_mapping:
-        del call_to_sip_mapping[call_uuid]
+    if call_uuid:
+        await delete_call_mapping(request.app.state.redis, call_uuid)
     
     # You don't need to return anything for hangup webhooks
     return {"status": "received"}
@@ -167,34 +205,10 @@ async def plivo_fallback_handler(request: Request):
     
     call_uuid = form_data.get("CallUUID")
     
-    print(f"Fallback triggered for CallUUID: {call_uuid}")
+    logger.warning("Fallback triggered for CallUUID: {}", call_uuid)
     
     # Return a simple error message
-    fallback_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>We're sorry, but we're unable to connect your call at this time. Please try again later.</Speak>
-    <Hangup/>
-</Response>"""
-    
-    return PlainTextResponse(fallback_xml, media_type="application/xml")
-
-
-# Alternative: Using Plivo's XML builder
-def create_plivo_dial_xml(sip_uri: str, from_number: str):
-    """
-    Create Plivo XML using ElementTree (more programmatic approach)
-    """
-    response = ET.Element("Response")
-    
-    dial = ET.SubElement(response, "Dial")
-    dial.set("callerId", from_number)
-    
-    user = ET.SubElement(dial, "User")
-    user.text = sip_uri
-    
-    # Convert to string
-    xml_string = ET.tostring(response, encoding="unicode")
-    return f'<?xml version="1.0" encoding="UTF-8"?>\n{xml_string}'
+    return Response(content=FALLBACK_XML, media_type="application/xml")
 
 
 # Example of more complex XML responses
@@ -279,7 +293,7 @@ async def handle_plivo_fallback(request: Request):
 # In your handle_outbound_call function, after getting the SIP URI:
 
 call_id = generate_unique_id()  # Generate a unique ID
-store_call_mapping(call_id, sip_uri, phone_number)
+await store_call_mapping(app.state.redis, call_id, sip_uri, phone_number)
 
 # Then when creating the Plivo call, use your webhook URLs:
 response = plivo_client.calls.create(
@@ -1,23 +1,40 @@
 import os
 import sys
+import asyncio
 import argparse
-import subprocess
 import uuid
 import ssl
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import PlainTextResponse
+import certifi
+import httpx
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    retry_if_result,
+    stop_after_attempt,
+    wait_exponential
+)
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+from fastapi.responses import Response
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from loguru import logger
+from redis.asyncio import Redis
 from plivo_handlers import (
     plivo_answer_handler,
     plivo_hangup_handler,
     plivo_fallback_handler,
     store_call_mapping,
-    call_to_sip_mapping
+    normalize_phone,
+    speak_and_hangup_xml,
+    build_dial_xml
 )
 
 load_dotenv(override=True)
 
+# Configure logging
+logger.remove()
+logger.add(sys.stderr, level=os.getenv("LOG_LEVEL", "INFO"))
+
 # Daily configuration
 DAILY_API_KEY = os.getenv("DAILY_API_KEY")
 DAILY_API_URL = os.getenv("DAILY_API_URL", "https://api.daily.co/v1")
@@ -27,17 +44,75 @@ PLIVO_AUTH_ID = os.getenv("PLIVO_AUTH_ID")
 PLIVO_AUTH_TOKEN = os.getenv("PLIVO_AUTH_TOKEN")
 SERVER_URL = os.getenv("SERVER_URL", "http://localhost:8000")
 
-# Store bot subprocess
-bot_procs = []
+# Redis configuration (shared call mapping store). When unset, mappings are
+# kept in memory and the server must run with a single worker.
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Static error responses for the inbound webhook
+PROCESSING_ERROR_XML = speak_and_hangup_xml("Sorry, there was an error processing your call.")
+ROOM_ERROR_XML = speak_and_hangup_xml(
+    "Sorry, we're unable to connect your call at this time. Please try again later."
+)
+SETUP_ERROR_XML = speak_and_hangup_xml("Sorry, there was an error setting up your call.")
+SIP_ERROR_XML = speak_and_hangup_xml("Sorry, we're unable to connect your call. Please try again later.")
+UNEXPECTED_ERROR_XML = speak_and_hangup_xml(
+    "Sorry, there was an error processing your call. Please try again later."
+)
+
+# Bot script location and environment, resolved once at import
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_PATH = os.path.join(SCRIPT_DIR, "bot.py")
+BOT_EXISTS = os.path.exists(BOT_PATH)
+BASE_ENV = os.environ.copy()
+
+# Running bot subprocesses, keyed by Plivo CallUUID. Entries are removed
+# as soon as the process exits, so this only holds live calls.
+bot_procs = {}
+reaper_tasks = set()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if not BOT_EXISTS:
+        logger.warning("Bot file not found: {}", BOT_PATH)
+    
+    app.state.redis = Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+    # Share one HTTP/2 connection pool across Daily API calls, so each inbound
+    # call's requests are multiplexed over an already warm TLS connection
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    app.state.daily = httpx.AsyncClient(
+        http2=True,
+        base_url=DAILY_API_URL,
+        headers={"Authorization": f"Bearer {DAILY_API_KEY}"},
+        verify=ssl_context,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=50)
+    )
     yield
+    await app.state.daily.aclose()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
     # Clean up bot processes
-    for proc in bot_procs:
-        proc.terminate()
-        proc.wait()
+    for proc in list(bot_procs.values()):
+        if proc.returncode is None:
+            proc.terminate()
+            await proc.wait()
+
+
+async def reap_bot(call_uuid: str, proc):
+    """Wait for a bot process to exit and forget about it"""
+    await proc.wait()
+    if bot_procs.get(call_uuid) is proc:
+        del bot_procs[call_uuid]
+    logger.debug("Bot process {} exited with code {}", proc.pid, proc.returncode)
+
+
+def track_bot(call_uuid: str, proc):
+    """Register a bot process and schedule it to be reaped when it exits"""
+    bot_procs[call_uuid] = proc
+    task = asyncio.create_task(reap_bot(call_uuid, proc))
+    reaper_tasks.add(task)
+    task.add_done_callback(reaper_tasks.discard)
 
 
 app = FastAPI(lifespan=lifespan)
@@ -67,7 +142,15 @@ async def handle_plivo_answer(request: Request):
 @app.post("/plivo-hangup")
 async def handle_plivo_hangup(request: Request):
     """Plivo webhook for when a call ends"""
-    return await plivo_hangup_handler(request)
+    result = await plivo_hangup_handler(request)
+    
+    # Stop this call's bot instead of waiting for it to notice the call ended
+    form_data = await request.form()
+    proc = bot_procs.get(form_data.get("CallUUID"))
+    if proc and proc.returncode is None:
+        proc.terminate()
+    
+    return result
 
 
 @app.post("/plivo-fallback")
@@ -88,14 +171,14 @@ async def store_call_mapping_endpoint(request: Request):
         if not all([call_id, sip_uri, phone_number]):
             raise HTTPException(status_code=400, detail="Missing required fields")
         
-        store_call_mapping(call_id, sip_uri, phone_number)
+        await store_call_mapping(app.state.redis, call_id, sip_uri, phone_number)
         return {"status": "success", "call_id": call_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/plivo-inbound")
-async def handle_inbound_call(request: Request):
+async def handle_inbound_call(request: Request, background_tasks: BackgroundTasks):
     """
     Handles incoming calls to the Plivo phone number.
     This endpoint is called by Plivo when someone calls your Plivo number.
@@ -115,156 +198,128 @@ async def handle_inbound_call(request: Request):
         to_number = form_data.get("To")  # Your Plivo phone number
         call_status = form_data.get("CallStatus")
         
-        print(f"=== Inbound Call Received ===")
-        print(f"CallUUID: {call_uuid}")
-        print(f"From: {from_number}")
-        print(f"To: {to_number}")
-        print(f"Status: {call_status}")
+        logger.info(
+            "Inbound call received - CallUUID: {}, From: {}, To: {}, Status: {}",
+            call_uuid, from_number, to_number, call_status
+        )
         
         if not call_uuid:
             # Return error XML if we don't have a call UUID
-            error_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, there was an error processing your call.</Speak>
-    <Hangup/>
-</Response>"""
-            return PlainTextResponse(error_xml, media_type="application/xml")
+            return Response(content=PROCESSING_ERROR_XML, media_type="application/xml")
         
         # Create Daily room with dial-in SIP capabilities
         room_response = await create_daily_room()
         
         if not room_response:
-            error_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, we're unable to connect your call at this time. Please try again later.</Speak>
-    <Hangup/>
-</Response>"""
-            return PlainTextResponse(error_xml, media_type="application/xml")
+            return Response(content=ROOM_ERROR_XML, media_type="application/xml")
         
         room_url = room_response["url"]
         room_name = room_response["name"]
-        token_result = await create_daily_token(room_name)
+        
+        # Daily usually includes the SIP endpoint in the room-creation response
+        sip_uri = sip_uri_from_room(room_response)
+        if sip_uri:
+            token_result = await create_daily_token(room_name)
+        else:
+            # Otherwise look it up from the room config while the token is created
+            token_result, sip_uri = await asyncio.gather(
+                create_daily_token(room_name),
+                get_daily_sip_uri(room_name)
+            )
         
         if isinstance(token_result, dict) and "error" in token_result:
-            error_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, there was an error setting up your call.</Speak>
-    <Hangup/>
-</Response>"""
-            return PlainTextResponse(error_xml, media_type="application/xml")
+            return Response(content=SETUP_ERROR_XML, media_type="application/xml")
         
         if not token_result:
-            error_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, there was an error setting up your call.</Speak>
-    <Hangup/>
-</Response>"""
-            return PlainTextResponse(error_xml, media_type="application/xml")
+            return Response(content=SETUP_ERROR_XML, media_type="application/xml")
         
         token = token_result
         
-        # Get Daily SIP URI from room configuration
-        sip_uri = await get_daily_sip_uri(room_name)
         if not sip_uri:
-            error_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, we're unable to connect your call. Please try again later.</Speak>
-    <Hangup/>
-</Response>"""
-            return PlainTextResponse(error_xml, media_type="application/xml")
+            return Response(content=SIP_ERROR_XML, media_type="application/xml")
         
         # Store the mapping for this call
         # We'll use call_uuid as the key since that's what Plivo sends in webhooks
-        store_call_mapping(call_uuid, sip_uri, from_number)
+        await store_call_mapping(app.state.redis, call_uuid, sip_uri, from_number)
         # Also store by phone number (normalized)
         if from_number:
-            store_call_mapping(from_number, sip_uri, from_number)
-            phone_no_plus = from_number.lstrip('+')
-            store_call_mapping(phone_no_plus, sip_uri, from_number)
+            await store_call_mapping(app.state.redis, normalize_phone(from_number), sip_uri, from_number)
         
-        print(f"Stored mapping for call_uuid: {call_uuid}, from: {from_number}")
-        print(f"SIP URI: {sip_uri}")
+        logger.debug("Stored mapping for call_uuid: {}, from: {}, SIP URI: {}", call_uuid, from_number, sip_uri)
         
-        # Start the bot process in the background
-        try:
-            # Get the directory where this script is located
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            bot_path = os.path.join(script_dir, "bot.py")
-            
-            # Ensure the bot file exists
-            if not os.path.exists(bot_path):
-                print(f"Warning: Bot file not found: {bot_path}")
-            else:
-                # Start bot process with logs written to a file
-                log_file_path = os.path.join(script_dir, f"bot_{room_name}.log")
-                log_file = open(log_file_path, "w")
-                
-                proc = subprocess.Popen(
-                    [
-                        sys.executable,
-                        bot_path,
-                        "-u", room_url,
-                        "-t", token,
-                        "-n", from_number or "unknown",
-                        "-s", sip_uri
-                    ],
-                    cwd=script_dir,
-                    stdout=log_file,
-                    stderr=subprocess.STDOUT,
-                    env=os.environ.copy()
-                )
-                bot_procs.append(proc)
-                print(f"Bot process started (PID: {proc.pid})")
-                print(f"Bot logs: {log_file_path}")
-                
-                # Give bot a moment to start (but don't wait too long - Plivo expects quick response)
-                import asyncio
-                await asyncio.sleep(2)  # Wait 2 seconds for bot to start
-            
-        except Exception as e:
-            print(f"Warning: Failed to start bot process: {str(e)}")
-            # Continue anyway - we'll still return the SIP connection XML
+        # Start the bot once the XML has been sent, so Plivo can begin dialing
+        # the SIP endpoint while the bot boots. The Dial timeout covers the
+        # time it needs to join.
+        if BOT_EXISTS:
+            background_tasks.add_task(spawn_bot, call_uuid, room_name, room_url, token, from_number, sip_uri)
         
         # Return Plivo XML to connect the call to Daily's SIP endpoint
         # Use the caller's number as callerId
         caller_id = from_number or to_number
         
-        xml_response = f"""<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Dial callerId="{caller_id}" timeout="30">
-        <User>{sip_uri}</User>
-    </Dial>
-</Response>"""
+        xml_response = build_dial_xml(caller_id, sip_uri)
         
-        print(f"Returning Plivo XML to connect call to Daily SIP endpoint")
-        return PlainTextResponse(xml_response, media_type="application/xml")
+        logger.debug("Returning Plivo XML to connect call to Daily SIP endpoint")
+        return Response(content=xml_response, media_type="application/xml")
             
     except Exception as e:
-        import traceback
-        error_msg = f"Error in handle_inbound_call: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
+        logger.exception("Error in handle_inbound_call: {}", e)
         # Return a valid XML response even on error
-        error_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<Response>
-    <Speak>Sorry, there was an error processing your call. Please try again later.</Speak>
-    <Hangup/>
-</Response>"""
-        return PlainTextResponse(error_xml, media_type="application/xml")
+        return Response(content=UNEXPECTED_ERROR_XML, media_type="application/xml")
+
+
+async def spawn_bot(call_uuid: str, room_name: str, room_url: str, token: str, from_number: str, sip_uri: str):
+    """Start the bot process for a call"""
+    try:
+        # Start bot process with logs written to a file. The child keeps
+        # its own copy of the descriptor, so ours can be closed right away.
+        log_file_path = os.path.join(SCRIPT_DIR, f"bot_{room_name}.log")
+        with open(log_file_path, "w") as log_file:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                BOT_PATH,
+                "-u", room_url,
+                "-t", token,
+                "-n", from_number or "unknown",
+                "-s", sip_uri,
+                cwd=SCRIPT_DIR,
+                stdout=log_file,
+                stderr=asyncio.subprocess.STDOUT,
+                env=BASE_ENV
+            )
+        track_bot(call_uuid, proc)
+        logger.info("Bot process started (PID: {}), logs: {}", proc.pid, log_file_path)
+    except Exception as e:
+        # The call has already been handed to the SIP endpoint at this point
+        logger.warning("Failed to start bot process: {}", e)
+
+
+def _is_server_error(result):
+    status, _ = result
+    return status >= 500
+
+
+@retry(
+    stop=stop_after_attempt(2),
+    wait=wait_exponential(multiplier=0.05),
+    retry=retry_if_exception_type(httpx.TransportError) | retry_if_result(_is_server_error),
+    # Hand the last response back to the caller instead of raising RetryError
+    retry_error_callback=lambda retry_state: retry_state.outcome.result()
+)
+async def daily_request(method: str, path: str, **kwargs):
+    """
+    Call the Daily REST API, retrying once on network errors and 5xx responses.
+    Returns (status, body) with the parsed JSON body on success, or the
+    response text otherwise.
+    """
+    response = await app.state.daily.request(method, path, **kwargs)
+    if response.status_code == 200:
+        return response.status_code, response.json()
+    return response.status_code, response.text
 
 
 async def create_daily_room():
     """Create a Daily room configured for dial-in"""
-    import aiohttp
-    import certifi
-    
-    # Create SSL context that uses certifi certificates
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {DAILY_API_KEY}"
-    }
-    
     data = {
         "properties": {
             "enable_dialout": True,  # Enable dial-out from within the room
@@ -276,36 +331,16 @@ async def create_daily_room():
         }
     }
     
-    # Create connector with SSL context
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.post(
-            f"{DAILY_API_URL}/rooms",
-            headers=headers,
-            json=data
-        ) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                print(f"Failed to create Daily room: {response.status}")
-                print(await response.text())
-                return None
+    status, body = await daily_request("POST", "/rooms", json=data)
+    if status == 200:
+        return body
+    else:
+        logger.error("Failed to create Daily room: {} {}", status, body)
+        return None
 
 
 async def create_daily_token(room_name: str):
     """Create a Daily token for the room"""
-    import aiohttp
-    import certifi
-    
-    # Create SSL context that uses certifi certificates
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {DAILY_API_KEY}"
-    }
-    
     data = {
         "properties": {
             "room_name": room_name,
@@ -313,82 +348,41 @@ async def create_daily_token(room_name: str):
         }
     }
     
-    # Create connector with SSL context
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.post(
-            f"{DAILY_API_URL}/meeting-tokens",
-            headers=headers,
-            json=data
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                return result.get("token")
-            else:
-                error_text = await response.text()
-                print(f"Failed to create token: {response.status}")
-                print(f"Error response: {error_text}")
-                return {"error": f"HTTP {response.status}: {error_text}"}
+    status, body = await daily_request("POST", "/meeting-tokens", json=data)
+    if status == 200:
+        return body.get("token")
+    else:
+        logger.error("Failed to create token: {} {}", status, body)
+        return {"error": f"HTTP {status}: {body}"}
+
+
+def sip_uri_from_room(room: dict):
+    """
+    Build the SIP URI from a Daily room object, or return None if the room
+    has no SIP endpoint. Daily provides the full endpoint in config.sip_uri.endpoint,
+    typically in the format: room_name.0@daily-xxx-app.dapp.signalwire.com
+    """
+    sip_endpoint = room.get("config", {}).get("sip_uri", {}).get("endpoint")
+    return f"sip:{sip_endpoint}" if sip_endpoint else None
 
 
 async def get_daily_sip_uri(room_name: str):
     """Get the SIP URI for a Daily room"""
-    import aiohttp
-    import certifi
-    
-    # Create SSL context that uses certifi certificates
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    
-    headers = {
-        "Authorization": f"Bearer {DAILY_API_KEY}"
-    }
-    
-    # Create connector with SSL context
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.get(
-            f"{DAILY_API_URL}/rooms/{room_name}",
-            headers=headers
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                # Daily SIP URI format for dial-in: sip:room_name@domain.daily.co
-                # Try to get domain from room config, or use default
-                config = result.get("config", {})
-                sip_config = config.get("sip", {})
-                
-                # Extract domain from Daily account (usually in the format: account.daily.co)
-                # For now, use a default format - Daily typically uses: room_name@domain.daily.co
-                # The domain part might be account-specific, but for dial-in it's usually:
-                # sip:room_name@domain.daily.co or sip:room_name@domain
-                
-                # Daily provides the SIP endpoint in config.sip_uri.endpoint
-                config = result.get("config", {})
-                sip_uri_config = config.get("sip_uri", {})
-                sip_endpoint = sip_uri_config.get("endpoint")
-                
-                if sip_endpoint:
-                    # Daily provides the full SIP endpoint, use it directly
-                    # Format is typically: room_name.0@daily-xxx-app.dapp.signalwire.com
-                    sip_uri = f"sip:{sip_endpoint}"
-                    print(f"Using Daily-provided SIP endpoint: {sip_uri}")
-                else:
-                    # Fallback: construct from room name (shouldn't happen if SIP is enabled)
-                    print(f"WARNING: No SIP endpoint found in room config, using fallback")
-                    print(f"Room config: {config}")
-                    sip_uri = f"sip:{room_name}@sip.daily.co"
-                
-                print(f"Room name: {room_name}")
-                print(f"SIP URI config: {sip_uri_config}")
-                print(f"Final SIP URI: {sip_uri}")
-                return sip_uri
-            else:
-                error_text = await response.text()
-                print(f"Failed to get room info: {response.status}")
-                print(f"Error response: {error_text}")
-                return None
+    status, result = await daily_request("GET", f"/rooms/{room_name}")
+    if status == 200:
+        sip_uri = sip_uri_from_room(result)
+        
+        if sip_uri:
+            logger.debug("Using Daily-provided SIP endpoint: {}", sip_uri)
+        else:
+            # Fallback: construct from room name (shouldn't happen if SIP is enabled)
+            logger.warning("No SIP endpoint found in room config, using fallback. Room config: {}", result.get("config"))
+            sip_uri = f"sip:{room_name}@sip.daily.co"
+        
+        return sip_uri
+    else:
+        logger.error("Failed to get room info: {} {}", status, result)
+        return None
 
 
 if __name__ == "__main__":
@@ -397,13 +391,32 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Daily Direct Dial-out Server")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to bind to")
     parser.add_argument("--port", type=int, default=8000, help="Port to bind to")
-    parser.add_argument("--reload", action="store_true", help="Enable auto-reload")
+    parser.add_argument("--reload", action="store_true", help="Enable auto-reload (runs a single worker)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: CPU count with REDIS_URL set, otherwise 1)"
+    )
     
     args = parser.parse_args()
     
+    if args.reload and (args.workers or 1) > 1:
+        parser.error("--reload and --workers are mutually exclusive")
+    
+    # Workers only share call mappings through Redis
+    workers = args.workers or ((os.cpu_count() or 2) if REDIS_URL else 1)
+    if workers > 1 and not REDIS_URL:
+        logger.warning("Running {} workers without REDIS_URL; call mappings won't be shared", workers)
+    
     uvicorn.run(
         "server:app",
         host=args.host,
         port=args.port,
-        reload=args.reload
+        reload=args.reload,
+        workers=None if args.reload else workers,
+        # "auto" picks uvloop and httptools when uvicorn[standard] installed
+        # them, and falls back to asyncio/h11 where it didn't (e.g. Windows)
+        loop="auto",
+        http="auto"
     )
\ No newline at end of file
@@ -2,6 +2,8 @@ import os
 import sys
 import asyncio
 import argparse
+import aiohttp
+import certifi
 from loguru import logger
 from dotenv import load_dotenv
 
@@ -16,30 +18,22 @@ from pipecat.transports.services.daily import DailyParams, DailyTransport
 from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContext
 from pipecat.frames.frames import TextFrame
 
-load_dotenv(override=True)
-
-# Fix SSL certificate verification issues
-import ssl
-import certifi
-import os
-
-# Set SSL certificate path for Python
-os.environ['SSL_CERT_FILE'] = certifi.where()
-os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
-
-# Configure logging
-logger.remove()
-logger.add(sys.stderr, level="DEBUG")
 
-
-async def main(
+async def run_bot(
     room_url: str,
     token: str,
     phone_number: str,
-    sip_uri: str
+    sip_uri: str,
+    ready_url: str = None,
+    on_ready=None,
+    handle_sigint: bool = True
 ):
     """
     Main bot logic using Plivo for dial-out
+
+    The server can run this in its own event loop: pass on_ready to be
+    called once the bot has joined, and handle_sigint=False so the server
+    keeps its own signal handling.
     """
     # Configure Daily transport
     transport = DailyTransport(
@@ -113,6 +107,17 @@ async def main(
         logger.info(f"Bot joined the room - waiting for call to connect via Plivo -> Daily SIP")
         logger.info(f"Bot participant info: {participant}")
         
+        # Let the server know it can place the Plivo call now
+        if on_ready:
+            on_ready()
+        elif ready_url:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(ready_url) as response:
+                        logger.info(f"Reported ready to server: {response.status}")
+            except Exception as e:
+                logger.error(f"Failed to report ready to server: {e}")
+        
     @transport.event_handler("on_participant_joined")
     async def on_participant_joined(transport, participant):
         logger.info(f"=== PARTICIPANT JOINED ===")
@@ -162,25 +167,39 @@ async def main(
         logger.info(f"Transcription received: {transcription}")
     
     # Run the pipeline
-    runner = PipelineRunner()
+    runner = PipelineRunner(handle_sigint=handle_sigint)
     
     await runner.run(task)
 
 
 if __name__ == "__main__":
+    # Only touch the environment when running as a script, so importing
+    # run_bot into the server has no side effects
+    load_dotenv(override=True)
+    
+    # Fix SSL certificate verification issues: set the certificate path for Python
+    os.environ['SSL_CERT_FILE'] = certifi.where()
+    os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
+    
+    # Configure logging
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG")
+    
     parser = argparse.ArgumentParser(description="Pipecat Plivo Dial-out Bot")
     parser.add_argument("-u", "--url", type=str, required=True, help="Daily room URL")
     parser.add_argument("-t", "--token", type=str, required=True, help="Daily token")
     parser.add_argument("-n", "--number", type=str, required=True, help="Phone number to call")
     parser.add_argument("-s", "--sip", type=str, required=True, help="Daily SIP URI")
+    parser.add_argument("-r", "--ready-url", type=str, default=None, help="URL to POST to once the bot has joined")
     
     args = parser.parse_args()
     
     asyncio.run(
-        main(
+        run_bot(
             room_url=args.url,
             token=args.token,
             phone_number=args.number,
-            sip_uri=args.sip
+            sip_uri=args.sip,
+            ready_url=args.ready_url
         )
     )
\ No newline at end of file
@@ -5,31 +5,137 @@ This file contains the webhook handlers needed for Plivo to properly
 connect calls to the Daily SIP endpoint.
 """
 
+import time
+import hashlib
+from dataclasses import dataclass
 from fastapi import Request
 from fastapi.responses import PlainTextResponse
+from cachetools import TTLCache
+from loguru import logger
+from redis.exceptions import NoScriptError
 import xml.etree.ElementTree as ET
 
 
-# In-memory storage for call mapping (use Redis or database in production)
-call_to_sip_mapping = {}
+@dataclass(slots=True)
+class CallEntry:
+    """
+    A call's SIP URI, phone number and Daily room. One entry is shared by
+    every key the call is stored under; keys records them for cleanup.
+    """
+    sip_uri: str
+    phone_number: str
+    created_at: float
+    room_name: str = ""
+    keys: tuple = ()
+
+
+# Call mappings live in Redis so they are shared between uvicorn workers
+# (and servers). Entries expire on their own if Plivo never sends the
+# hangup webhook.
+CALL_MAPPING_TTL = 3600
+
+# Without Redis (redis=None) mappings are kept in process memory, which
+# only works with a single worker. The cache is bounded so that entries
+# whose hangup webhook never arrives can't grow it forever.
+call_to_sip_mapping = TTLCache(maxsize=10000, ttl=CALL_MAPPING_TTL)
+
+
+# The inbound server stores its own (JSON string) mappings under "call:" and
+# may share this Redis database, so outbound keys use their own prefix
+CALL_KEY_PREFIX = "outbound-call:"
+
+
+def _call_key(key: str) -> str:
+    return f"{CALL_KEY_PREFIX}{key}"
+
+
+# Deletes each key only if it still holds the given entry. A newer call to
+# the same number overwrites the phone-number keys, and those must survive
+# the older call's hangup.
+DELETE_IF_OWNED_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    local value = redis.call("HMGET", key, "sip", "created_at")
+    if value[1] == ARGV[1] and value[2] == ARGV[2] then
+        redis.call("DEL", key)
+    end
+end
+"""
+# Hashed once, so each hangup is a single EVALSHA once Redis has the script
+DELETE_IF_OWNED_SHA = hashlib.sha1(DELETE_IF_OWNED_SCRIPT.encode()).hexdigest()
+
+
+def new_call_entry(sip_uri: str, phone_number: str, room_name: str = "") -> CallEntry:
+    """
+    Create an entry for a call that is being placed now.
+    The wall clock is used so the timestamp means the same in every worker.
+    """
+    return CallEntry(sip_uri, phone_number, time.time(), room_name)
 
 
-def store_call_mapping(call_id: str, sip_uri: str, phone_number: str):
+async def store_call_mapping(redis, entry: CallEntry, *keys: str):
     """
-    Store the mapping between call ID and SIP URI.
-    In production, use a database or Redis for this.
+    Store one call entry under each of the given keys. Empty keys are skipped.
     """
-    call_to_sip_mapping[call_id] = {
-        "sip_uri": sip_uri,
-        "phone_number": phone_number
+    entry.keys = tuple(key for key in keys if key)
+    if redis is None:
+        for key in entry.keys:
+            call_to_sip_mapping[key] = entry
+        return
+    
+    # The entry is serialized once and written to every key in one round trip
+    mapping = {
+        "sip": entry.sip_uri,
+        "phone": entry.phone_number,
+        "created_at": entry.created_at,
+        "room": entry.room_name,
+        "keys": ",".join(entry.keys)
     }
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in entry.keys:
+            pipe.hset(_call_key(key), mapping=mapping)
+            pipe.expire(_call_key(key), CALL_MAPPING_TTL)
+        await pipe.execute()
 
 
-def get_call_mapping(call_uuid: str):
+async def get_call_mapping(redis, call_uuid: str):
     """
-    Retrieve the mapping for a call.
+    Retrieve the entry for a call.
     """
-    return call_to_sip_mapping.get(call_uuid)
+    if redis is None:
+        return call_to_sip_mapping.get(call_uuid)
+    
+    value = await redis.hgetall(_call_key(call_uuid))
+    if not value:
+        return None
+    return CallEntry(
+        value["sip"],
+        value["phone"],
+        float(value["created_at"]),
+        value.get("room", ""),
+        tuple(value["keys"].split(","))
+    )
+
+
+async def delete_call_mapping(redis, entry: CallEntry):
+    """
+    Remove an entry under every key it was stored with, skipping keys that
+    have since been taken over by another call.
+    """
+    if redis is None:
+        for key in entry.keys:
+            if call_to_sip_mapping.get(key) is entry:
+                del call_to_sip_mapping[key]
+        return
+    
+    # Compare and delete in one atomic step, so a call stored in between
+    # can't be removed
+    keys = [_call_key(key) for key in entry.keys]
+    args = [entry.sip_uri, entry.created_at]
+    try:
+        await redis.evalsha(DELETE_IF_OWNED_SHA, len(keys), *keys, *args)
+    except NoScriptError:
+        # First use on this Redis server (or its script cache was flushed)
+        await redis.eval(DELETE_IF_OWNED_SCRIPT, len(keys), *keys, *args)
 
 
 # Add these endpoints to your FastAPI app
@@ -47,62 +153,37 @@ async def plivo_answer_handler(request: Request):
         
         # Extract call information
         call_uuid = form_data.get("CallUUID")
+        request_uuid = form_data.get("RequestUUID")
         from_number = form_data.get("From")
         to_number = form_data.get("To")
         call_status = form_data.get("CallStatus")
         
         # Also check for call_id in query parameters (we pass it in the URL)
         call_id = request.query_params.get("call_id")
+        redis = request.app.state.redis
         
-        print(f"=== Plivo Answer Webhook ===")
-        print(f"CallUUID: {call_uuid}")
-        print(f"CallID (query): {call_id}")
-        print(f"From: {from_number}")
-        print(f"To: {to_number}")
-        print(f"Status: {call_status}")
-        print(f"All form data: {dict(form_data)}")
-        print(f"All mappings in storage: {call_to_sip_mapping}")
-        print(f"Mapping keys: {list(call_to_sip_mapping.keys())}")
-        
-        # Retrieve the SIP URI for this call (try call_id first, then call_uuid, then phone number)
-        mapping = None
-        
-        # Try by call_id (from query params)
-        if call_id:
-            mapping = get_call_mapping(call_id)
-            print(f"Tried call_id '{call_id}', mapping: {mapping}")
-        
-        # Try by call_uuid (from Plivo webhook)
-        if not mapping and call_uuid:
-            mapping = get_call_mapping(call_uuid)
-            print(f"Tried call_uuid '{call_uuid}', mapping: {mapping}")
+        logger.info(
+            "Plivo answer webhook - CallUUID: {}, RequestUUID: {}, CallID (query): {}, From: {}, To: {}, Status: {}",
+            call_uuid, request_uuid, call_id, from_number, to_number, call_status
+        )
+        # loguru only formats the FormData when debug logging is enabled
+        logger.debug("All form data: {}", form_data)
         
-        # Try by phone number (to_number from webhook) - with and without +
-        if not mapping and to_number:
-            mapping = get_call_mapping(to_number)
-            print(f"Tried phone number '{to_number}', mapping: {mapping}")
-            
-            if not mapping:
-                to_no_plus = to_number.lstrip('+')
-                mapping = get_call_mapping(to_no_plus)
-                print(f"Tried phone number without + '{to_no_plus}', mapping: {mapping}")
-        
-        # Last resort: search by phone number in values
-        if not mapping:
-            print(f"Searching all mappings by phone number...")
-            for key, value in call_to_sip_mapping.items():
-                stored_phone = value.get("phone_number", "")
-                print(f"  Checking key '{key}' -> phone '{stored_phone}' vs '{to_number}'")
-                if stored_phone == to_number or stored_phone == to_number.lstrip('+') or stored_phone.lstrip('+') == to_number:
-                    mapping = value
-                    print(f"Found mapping by searching phone number in values: key='{key}'")
-                    break
+        # Retrieve the SIP URI for this call: try call_id (query params) first,
+        # then request_uuid (returned when the call was created), call_uuid
+        # (Plivo webhook), then the phone number with and without +.
+        # Stops at the first lookup that finds a mapping.
+        mapping = (
+            (await get_call_mapping(redis, call_id) if call_id else None)
+            or (await get_call_mapping(redis, request_uuid) if request_uuid else None)
+            or (await get_call_mapping(redis, call_uuid) if call_uuid else None)
+            or (await get_call_mapping(redis, to_number) if to_number else None)
+            or (await get_call_mapping(redis, to_number.lstrip('+')) if to_number and to_number.startswith('+') else None)
+        )
         
         if not mapping:
             # If we don't have the mapping, return an error response
-            print(f"ERROR: No mapping found for call. CallUUID: {call_uuid}, CallID: {call_id}")
-            print(f"Available mappings: {list(call_to_sip_mapping.keys())}")
-            print(f"All mappings: {call_to_sip_mapping}")
+            logger.error("No mapping found for call. CallUUID: {}, CallID: {}", call_uuid, call_id)
             error_xml = """<?xml version="1.0" encoding="UTF-8"?>
 <Response>
     <Speak>Sorry, there was an error connecting your call.</Speak>
@@ -110,8 +191,8 @@ async def plivo_answer_handler(request: Request):
 </Response>"""
             return PlainTextResponse(error_xml, media_type="application/xml")
         
-        sip_uri = mapping["sip_uri"]
-        print(f"Using SIP URI: {sip_uri}")
+        sip_uri = mapping.sip_uri
+        logger.debug("Using SIP URI: {}", sip_uri)
         
         # Create Plivo XML to connect to Daily's SIP endpoint
         # Using the <User> element to dial a SIP URI
@@ -122,12 +203,10 @@ async def plivo_answer_handler(request: Request):
     </Dial>
 </Response>"""
         
-        print(f"Returning XML: {xml_response}")
+        logger.debug("Returning XML: {}", xml_response)
         return PlainTextResponse(xml_response, media_type="application/xml")
     except Exception as e:
-        import traceback
-        error_msg = f"Error in plivo_answer_handler: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg)
+        logger.exception("Error in plivo_answer_handler: {}", e)
         # Return a valid XML response even on error
         error_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
 <Response>
@@ -137,22 +216,35 @@ async def plivo_answer_handler(request: Request):
         return PlainTextResponse(error_xml, media_type="application/xml")
 
 
-async def plivo_hangup_handler(request: Request):
+async def plivo_hangup_handler(request: Request, on_call_ended=None):
     """
     Plivo calls this endpoint when a call ends.
     This is the hangup_url that you can optionally set.
+    
+    on_call_ended is called with the call's entry, e.g. to stop its bot.
     """
     form_data = await request.form()
     
     call_uuid = form_data.get("CallUUID")
+    # The mapping is stored under the request_uuid returned when the call was
+    # created, which Plivo sends back as RequestUUID (not CallUUID)
+    request_uuid = form_data.get("RequestUUID")
     hangup_cause = form_data.get("HangupCause")
     duration = form_data.get("Duration")
     
-    print(f"Call ended - CallUUID: {call_uuid}, Cause: {hangup_cause}, Duration: {duration}s")
+    logger.info("Call ended - CallUUID: {}, Cause: {}, Duration: {}s", call_uuid, hangup_cause, duration)
     
-    # Clean up the mapping
-    if call_uuid in call_to_sip_mapping:
-        del call_to_sip_mapping[call_uuid]
+    # Clean up the mapping under every key it was stored with. The To number
+    # isn't used here: it may point at a newer call to the same number.
+    redis = request.app.state.redis
+    mapping = (
+        (await get_call_mapping(redis, request_uuid) if request_uuid else None)
+        or (await get_call_mapping(redis, call_uuid) if call_uuid else None)
+    )
+    if mapping:
+        if on_call_ended:
+            on_call_ended(mapping)
+        await delete_call_mapping(redis, mapping)
     
     # You don't need to return anything for hangup webhooks
     return {"status": "received"}
@@ -167,7 +259,7 @@ async def plivo_fallback_handler(request: Request):
     
     call_uuid = form_data.get("CallUUID")
     
-    print(f"Fallback triggered for CallUUID: {call_uuid}")
+    logger.warning("Fallback triggered for CallUUID: {}", call_uuid)
     
     # Return a simple error message
     fallback_xml = """<?xml version="1.0" encoding="UTF-8"?>
@@ -258,6 +350,7 @@ from plivo_handlers import (
     plivo_answer_handler,
     plivo_hangup_handler,
     plivo_fallback_handler,
+    new_call_entry,
     store_call_mapping
 )
 
@@ -279,7 +372,7 @@ async def handle_plivo_fallback(request: Request):
 # In your handle_outbound_call function, after getting the SIP URI:
 
 call_id = generate_unique_id()  # Generate a unique ID
-store_call_mapping(call_id, sip_uri, phone_number)
+await store_call_mapping(app.state.redis, new_call_entry(sip_uri, phone_number), call_id)
 
 # Then when creating the Plivo call, use your webhook URLs:
 response = plivo_client.calls.create(
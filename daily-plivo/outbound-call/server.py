@@ -1,61 +1,371 @@
 import os
 import sys
+import asyncio
 import argparse
-import subprocess
 import uuid
 import ssl
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import PlainTextResponse
-from contextlib import asynccontextmanager
+import aiohttp
+import certifi
+import orjson
+import plivo
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
+from fastapi.responses import PlainTextResponse, ORJSONResponse, Response
+from contextlib import asynccontextmanager, suppress
 from dotenv import load_dotenv
+from loguru import logger
+from redis.asyncio import Redis
 from plivo_handlers import (
     plivo_answer_handler,
     plivo_hangup_handler,
     plivo_fallback_handler,
-    store_call_mapping,
-    call_to_sip_mapping
+    new_call_entry,
+    store_call_mapping
 )
 
 load_dotenv(override=True)
 
+# Configure logging. enqueue=True hands records to a background thread, so
+# request handlers never block on writes to stderr.
+logger.remove()
+logger.add(
+    sys.stderr,
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    enqueue=True,
+    # In-process bots log to their own bot_<room_name>.log
+    filter=lambda record: "room" not in record["extra"]
+)
+
 # Daily configuration
 DAILY_API_KEY = os.getenv("DAILY_API_KEY")
 DAILY_API_URL = os.getenv("DAILY_API_URL", "https://api.daily.co/v1")
+DAILY_HEADERS = {"Authorization": f"Bearer {DAILY_API_KEY}"}
 
 # Plivo configuration
 PLIVO_AUTH_ID = os.getenv("PLIVO_AUTH_ID")
 PLIVO_AUTH_TOKEN = os.getenv("PLIVO_AUTH_TOKEN")
+PLIVO_PHONE_NUMBER = os.getenv("PLIVO_PHONE_NUMBER")
 SERVER_URL = os.getenv("SERVER_URL", "http://localhost:8000")
+PLIVO_ANSWER_URL = f"{SERVER_URL}/plivo-answer"
+PLIVO_HANGUP_URL = f"{SERVER_URL}/plivo-hangup"
+
+# Redis configuration (shared call mapping store). When unset, mappings are
+# kept in memory and the server must run with a single worker.
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Base URLs requested at startup to warm DNS, TCP and TLS for each API
+PLIVO_API_URL = "https://api.plivo.com/v1/"
+WARMUP_TIMEOUT = 5
+
+# How long to wait for a bot to report that it joined its room
+BOT_READY_TIMEOUT = 10
+
+# How long to wait for bots to exit on shutdown before killing them
+BOT_SHUTDOWN_TIMEOUT = 5
+
+# Longest an in-process bot may run. Bots normally stop when the callee
+# leaves or Plivo reports the hangup; this catches calls whose hangup
+# webhook went to another worker or never arrived.
+BOT_MAX_CALL_DURATION = 3600
+
+# "in-process" runs each bot as an asyncio task inside the server, which
+# skips interpreter startup and re-importing pipecat for every call.
+# "subprocess" starts a separate bot.py process per call instead.
+BOT_MODES = ("in-process", "subprocess")
+BOT_MODE = os.getenv("BOT_MODE", "in-process")
+if BOT_MODE not in BOT_MODES:
+    raise RuntimeError(f"BOT_MODE must be one of {', '.join(BOT_MODES)}, got {BOT_MODE!r}")
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_PATH = os.path.join(SCRIPT_DIR, "bot.py")
 
-# Store bot subprocess
-bot_procs = []
+if BOT_MODE == "in-process":
+    # bot.py points Python's TLS at certifi's CA bundle when it runs as a
+    # script. In-process bots share the server's environment, so set it here
+    # for their Deepgram, Cartesia and OpenAI clients.
+    os.environ["SSL_CERT_FILE"] = certifi.where()
+    os.environ["REQUESTS_CA_BUNDLE"] = certifi.where()
+    from bot import run_bot
+
+# Running bot subprocesses, keyed by Daily room name. Entries are removed
+# as soon as the process exits, so this only holds live calls.
+bot_procs = {}
+reaper_tasks = set()
+
+# Running in-process bots, keyed by Daily room name
+bot_tasks = {}
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    app.state.redis = (
+        Redis.from_url(REDIS_URL, decode_responses=True, max_connections=50)
+        if REDIS_URL else None
+    )
+    # Share one connection pool across outbound API calls so each request
+    # reuses warm keep-alive connections instead of a fresh TLS handshake
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=100,
+        limit_per_host=20,
+        keepalive_timeout=75,
+        enable_cleanup_closed=True,
+        ttl_dns_cache=300,
+        use_dns_cache=True
+    )
+    app.state.http = aiohttp.ClientSession(connector=connector)
+    # The Plivo SDK client is reused across calls. It refuses to build without
+    # credentials; /outbound-call reports those as missing.
+    app.state.plivo = (
+        plivo.RestClient(PLIVO_AUTH_ID, PLIVO_AUTH_TOKEN)
+        if PLIVO_AUTH_ID and PLIVO_AUTH_TOKEN else None
+    )
+    # Readiness events for bots that are starting up, keyed by room name
+    app.state.bot_ready = {}
+    await warm_up_connections(app)
     yield
-    # Clean up bot processes
-    for proc in bot_procs:
-        proc.terminate()
-        proc.wait()
+    await app.state.http.close()
+    if app.state.redis is not None:
+        await app.state.redis.aclose()
+    # Stop in-process bots
+    tasks = list(bot_tasks.values())
+    for task in tasks:
+        task.cancel()
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(
+            asyncio.gather(*tasks, return_exceptions=True),
+            timeout=BOT_SHUTDOWN_TIMEOUT
+        )
+    # Clean up bot processes: ask them all to stop, then kill any stragglers
+    procs = [proc for proc in bot_procs.values() if proc.returncode is None]
+    for proc in procs:
+        with suppress(ProcessLookupError):
+            proc.terminate()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(proc.wait() for proc in procs), return_exceptions=True),
+            timeout=BOT_SHUTDOWN_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        for proc in procs:
+            if proc.returncode is None:
+                with suppress(ProcessLookupError):
+                    proc.kill()
+
+
+async def warm_up_connections(app: FastAPI):
+    """
+    Open a keep-alive connection to each API before the first call needs it,
+    so DNS, TCP and TLS are already done. Failures are only logged.
+    """
+    async def warm_daily():
+        async with app.state.http.get(
+            f"{DAILY_API_URL}/",
+            allow_redirects=False,
+            timeout=aiohttp.ClientTimeout(total=WARMUP_TIMEOUT)
+        ) as response:
+            await response.read()
+    
+    async def warm_plivo():
+        # The Plivo SDK makes its calls through its own requests session,
+        # so that is the pool to warm
+        if app.state.plivo is not None:
+            await asyncio.to_thread(
+                app.state.plivo.session.get,
+                PLIVO_API_URL,
+                allow_redirects=False,
+                timeout=WARMUP_TIMEOUT
+            )
+    
+    results = await asyncio.gather(warm_daily(), warm_plivo(), return_exceptions=True)
+    for name, result in zip(("Daily", "Plivo"), results):
+        if isinstance(result, Exception):
+            logger.warning("Could not warm up {} API connection: {}", name, result)
+
+
+async def reap_bot(room_name: str, proc, log_file):
+    """Wait for a bot process to exit, then release its log file and forget it"""
+    try:
+        await proc.wait()
+    finally:
+        log_file.close()
+        if bot_procs.get(room_name) is proc:
+            del bot_procs[room_name]
+
+
+def track_bot(room_name: str, proc, log_file):
+    """
+    Register a bot process and schedule it to be reaped when it exits.
+    Returns the reaper task, which finishes when the process does.
+    """
+    bot_procs[room_name] = proc
+    task = asyncio.create_task(reap_bot(room_name, proc, log_file))
+    reaper_tasks.add(task)
+    task.add_done_callback(reaper_tasks.discard)
+    return task
+
 
+async def run_bot_in_process(room_name: str, room_url: str, token: str, phone_number: str, sip_uri: str, on_ready):
+    """Run a bot in this process, writing its logs to bot_<room_name>.log"""
+    log_file_path = os.path.join(SCRIPT_DIR, f"bot_{room_name}.log")
+    # Creating the file touches the filesystem, so do it off the event loop.
+    # enqueue=True gives each live call's sink its own writer thread, which
+    # keeps the bot's log writes off the event loop too.
+    sink_id = await asyncio.to_thread(
+        logger.add,
+        log_file_path,
+        level="DEBUG",
+        enqueue=True,
+        filter=lambda record: record["extra"].get("room") == room_name
+    )
+    try:
+        with logger.contextualize(room=room_name):
+            await asyncio.wait_for(
+                run_bot(
+                    room_url,
+                    token,
+                    phone_number,
+                    sip_uri,
+                    on_ready=on_ready,
+                    handle_sigint=False
+                ),
+                timeout=BOT_MAX_CALL_DURATION
+            )
+    except asyncio.TimeoutError:
+        logger.warning("Bot for room {} stopped after {}s", room_name, BOT_MAX_CALL_DURATION)
+    except Exception:
+        logger.exception("Bot for room {} failed", room_name)
+    finally:
+        # Removing the sink joins its writer thread and closes the file
+        await asyncio.to_thread(logger.remove, sink_id)
+
+
+def start_bot_task(room_name: str, room_url: str, token: str, phone_number: str, sip_uri: str, on_ready):
+    """Start an in-process bot and forget it once it finishes. Returns its task."""
+    task = asyncio.create_task(
+        run_bot_in_process(room_name, room_url, token, phone_number, sip_uri, on_ready)
+    )
+    bot_tasks[room_name] = task
+    
+    def forget_bot_task(done_task):
+        if bot_tasks.get(room_name) is done_task:
+            del bot_tasks[room_name]
+    
+    task.add_done_callback(forget_bot_task)
+    logger.info("Bot task started for room {}, waiting for it to join. Logs: bot_{}.log", room_name, room_name)
+    return task
+
+
+async def start_bot_process(room_name: str, room_url: str, token: str, phone_number: str, sip_uri: str, ready_url: str):
+    """
+    Start a bot.py subprocess that reports to ready_url once it has joined.
+    Returns a task that finishes when the process exits.
+    """
+    # Ensure the bot file exists
+    if not os.path.exists(BOT_PATH):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Bot file not found: {BOT_PATH}"
+        )
+    
+    # Start bot process with logs written to a file. Creating the file touches
+    # the filesystem, so do it off the event loop. The reaper closes it.
+    log_file_path = os.path.join(SCRIPT_DIR, f"bot_{room_name}.log")
+    log_file = await asyncio.to_thread(open, log_file_path, "w")
+    
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            BOT_PATH,
+            "-u", room_url,
+            "-t", token,
+            "-n", phone_number,
+            "-s", sip_uri,
+            "-r", ready_url,
+            # The bot inherits our environment and finds its .env next to bot.py,
+            # so there's no need to copy os.environ or set cwd
+            stdout=log_file,
+            stderr=asyncio.subprocess.STDOUT  # Combine stderr with stdout
+        )
+    except Exception:
+        log_file.close()
+        raise
+    reaper = track_bot(room_name, proc, log_file)
+    logger.info("Bot process started (PID: {}), waiting for it to join room. Logs: {}", proc.pid, log_file_path)
+    return reaper
+
+
+def stop_bot(entry):
+    """Stop the bot for a call that has ended, if it runs in this worker"""
+    task = bot_tasks.get(entry.room_name)
+    if task:
+        task.cancel()
+    
+    proc = bot_procs.get(entry.room_name)
+    if proc and proc.returncode is None:
+        with suppress(ProcessLookupError):
+            proc.terminate()
+
+
+async def record_call_mapping(call_uuid, room_name: str, phone_number: str, sip_uri: str, response):
+    """Store the call mapping for Plivo's webhooks and log the placed call"""
+    # IMPORTANT: Store mapping by phone number as well, since Plivo webhook uses CallUUID
+    # which might be different from request_uuid. We'll store multiple keys.
+    # Store by phone number (normalized - with and without +) and
+    # by call UUID if we have it, all sharing one entry
+    phone_no_plus = phone_number.lstrip('+')
+    entry = new_call_entry(sip_uri, phone_number, room_name)
+    await store_call_mapping(app.state.redis, entry, phone_number, phone_no_plus, call_uuid)
+    
+    logger.info(
+        "Plivo call initiated - phone number: {}, CallUUID: {}, SIP URI: {}",
+        phone_number, call_uuid, sip_uri
+    )
+    # loguru only formats the response when debug logging is enabled
+    logger.debug("Plivo call response: {}", response)
+
+
+async def finalize_call_mapping(call_uuid, room_name: str, phone_number: str, sip_uri: str, response):
+    """
+    Record the call mapping once the HTTP response has been sent. Plivo's
+    answer webhook only arrives after the callee picks up, well after this
+    has run.
+    
+    The client has already been told the call was initiated, so a failed
+    store (e.g. Redis unreachable) can only be logged. The call itself still
+    goes out, and the callee hears the connection error message on answer.
+    """
+    try:
+        await record_call_mapping(call_uuid, room_name, phone_number, sip_uri, response)
+    except Exception:
+        logger.exception("Failed to store call mapping for {}; the call will fail when answered", phone_number)
 
-app = FastAPI(lifespan=lifespan)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+
+async def read_json(request: Request):
+    """Parse a JSON request body with orjson"""
+    return orjson.loads(await request.body())
+
+
+# The health check response never changes, so serialize it once
+ROOT_RESPONSE_BODY = orjson.dumps({
+    "status": "ok",
+    "message": "Plivo SIP Dial-out Server",
+    "endpoints": {
+        "outbound_call": "/outbound-call",
+        "bot_ready": "/bot-ready/{room_name}",
+        "plivo_answer": "/plivo-answer",
+        "plivo_hangup": "/plivo-hangup",
+        "plivo_fallback": "/plivo-fallback"
+    }
+})
 
 
 @app.get("/")
 async def root():
     """Health check endpoint"""
-    return {
-        "status": "ok",
-        "message": "Plivo SIP Dial-out Server",
-        "endpoints": {
-            "outbound_call": "/outbound-call",
-            "plivo_answer": "/plivo-answer",
-            "plivo_hangup": "/plivo-hangup",
-            "plivo_fallback": "/plivo-fallback"
-        }
-    }
+    return Response(content=ROOT_RESPONSE_BODY, media_type="application/json")
 
 
 @app.post("/plivo-answer")
@@ -67,7 +377,7 @@ async def handle_plivo_answer(request: Request):
 @app.post("/plivo-hangup")
 async def handle_plivo_hangup(request: Request):
     """Plivo webhook for when a call ends"""
-    return await plivo_hangup_handler(request)
+    return await plivo_hangup_handler(request, on_call_ended=stop_bot)
 
 
 @app.post("/plivo-fallback")
@@ -76,11 +386,20 @@ async def handle_plivo_fallback(request: Request):
     return await plivo_fallback_handler(request)
 
 
+@app.post("/bot-ready/{room_name}")
+async def handle_bot_ready(room_name: str):
+    """Called by the bot once it has joined its Daily room"""
+    event = app.state.bot_ready.get(room_name)
+    if event:
+        event.set()
+    return {"status": "received"}
+
+
 @app.post("/store-call-mapping")
 async def store_call_mapping_endpoint(request: Request):
     """Store call mapping for Plivo webhooks"""
     try:
-        data = await request.json()
+        data = await read_json(request)
         call_id = data.get("call_id")
         sip_uri = data.get("sip_uri")
         phone_number = data.get("phone_number")
@@ -88,14 +407,14 @@ async def store_call_mapping_endpoint(request: Request):
         if not all([call_id, sip_uri, phone_number]):
             raise HTTPException(status_code=400, detail="Missing required fields")
         
-        store_call_mapping(call_id, sip_uri, phone_number)
+        await store_call_mapping(app.state.redis, new_call_entry(sip_uri, phone_number), call_id)
         return {"status": "success", "call_id": call_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/outbound-call")
-async def handle_outbound_call(request: Request):
+async def handle_outbound_call(request: Request, background_tasks: BackgroundTasks):
     """
     Initiates an outbound call using Daily's direct dial-out.
     
@@ -105,7 +424,7 @@ async def handle_outbound_call(request: Request):
     }
     """
     try:
-        data = await request.json()
+        data = await read_json(request)
         
         phone_number = data.get("phone_number")
         
@@ -126,7 +445,17 @@ async def handle_outbound_call(request: Request):
         
         room_url = room_response["url"]
         room_name = room_response["name"]
-        token_result = await create_daily_token(room_name)
+        
+        # Daily usually includes the SIP endpoint in the room-creation response
+        sip_uri = sip_uri_from_room(room_response)
+        if sip_uri:
+            token_result = await create_daily_token(room_name)
+        else:
+            # Otherwise look it up from the room config while the token is created
+            token_result, sip_uri = await asyncio.gather(
+                create_daily_token(room_name),
+                get_daily_sip_uri(room_name)
+            )
         
         if isinstance(token_result, dict) and "error" in token_result:
             raise HTTPException(
@@ -142,123 +471,88 @@ async def handle_outbound_call(request: Request):
         
         token = token_result
         
-        # Get Daily SIP URI from room configuration
-        sip_uri = await get_daily_sip_uri(room_name)
         if not sip_uri:
             raise HTTPException(
                 status_code=500,
                 detail="Failed to get Daily SIP URI"
             )
         
-        # Start the bot process FIRST so it's ready when the call comes in
+        # Start the bot FIRST so it's ready when the call comes in
+        bot_ready = app.state.bot_ready[room_name] = asyncio.Event()
         try:
-            # Get the directory where this script is located
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            bot_path = os.path.join(script_dir, "bot.py")
+            if BOT_MODE == "subprocess":
+                ready_url = str(request.url_for("handle_bot_ready", room_name=room_name))
+                bot_done = await start_bot_process(room_name, room_url, token, phone_number, sip_uri, ready_url)
+            else:
+                bot_done = start_bot_task(room_name, room_url, token, phone_number, sip_uri, on_ready=bot_ready.set)
+            
+            # Wait for the bot to report that it joined the room before making
+            # the call, but stop waiting if the bot exits first
+            ready_wait = asyncio.create_task(bot_ready.wait())
+            try:
+                await asyncio.wait(
+                    {ready_wait, bot_done},
+                    timeout=BOT_READY_TIMEOUT,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                ready_wait.cancel()
             
-            # Ensure the bot file exists
-            if not os.path.exists(bot_path):
+            if bot_ready.is_set():
+                logger.debug("Bot is in room now, making Plivo call")
+            elif bot_done.done():
                 raise HTTPException(
                     status_code=500,
-                    detail=f"Bot file not found: {bot_path}"
+                    detail=f"Bot exited before joining the room. Logs: bot_{room_name}.log"
                 )
+            else:
+                logger.warning("Bot did not report ready within {}s, making Plivo call anyway", BOT_READY_TIMEOUT)
             
-            # Start bot process with logs written to a file
-            log_file_path = os.path.join(script_dir, f"bot_{room_name}.log")
-            log_file = open(log_file_path, "w")
-            
-            proc = subprocess.Popen(
-                [
-                    sys.executable,
-                    bot_path,
-                    "-u", room_url,
-                    "-t", token,
-                    "-n", phone_number,
-                    "-s", sip_uri
-                ],
-                cwd=script_dir,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,  # Combine stderr with stdout
-                env=os.environ.copy()
-            )
-            bot_procs.append(proc)
-            print(f"Bot process started (PID: {proc.pid}), waiting for it to join room...")
-            print(f"Bot logs are being written to: {log_file_path}")
-            print(f"To view logs in real-time, run: tail -f {log_file_path}")
-            # Give bot time to join the room before making the call
-            import asyncio
-            await asyncio.sleep(5)  # Wait 5 seconds for bot to join and be ready
-            print(f"Bot should be in room now, making Plivo call...")
-            
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to start bot process: {str(e)}"
             )
+        finally:
+            app.state.bot_ready.pop(room_name, None)
         
         # Make the Plivo call from the server (after bot is in room)
-        plivo_auth_id = os.getenv("PLIVO_AUTH_ID")
-        plivo_auth_token = os.getenv("PLIVO_AUTH_TOKEN")
-        from_number = os.getenv("PLIVO_PHONE_NUMBER")
-        
-        if not all([plivo_auth_id, plivo_auth_token, from_number]):
+        if not all([PLIVO_AUTH_ID, PLIVO_AUTH_TOKEN, PLIVO_PHONE_NUMBER]):
             raise HTTPException(
                 status_code=500,
                 detail="Plivo credentials not configured"
             )
         
         try:
-            import plivo
-            plivo_client = plivo.RestClient(plivo_auth_id, plivo_auth_token)
-            
-            # Make the Plivo call
-            response = plivo_client.calls.create(
-                from_=from_number,
+            # Make the Plivo call. The SDK is synchronous, so run it in a worker
+            # thread to keep the event loop free while the Plivo API responds.
+            response = await asyncio.to_thread(
+                app.state.plivo.calls.create,
+                from_=PLIVO_PHONE_NUMBER,
                 to_=phone_number,
-                answer_url=f"{SERVER_URL}/plivo-answer",
+                answer_url=PLIVO_ANSWER_URL,
                 answer_method="POST",
-                hangup_url=f"{SERVER_URL}/plivo-hangup",
+                hangup_url=PLIVO_HANGUP_URL,
                 hangup_method="POST"
             )
             
-            # Plivo response is a dict-like object, try different ways to get the UUID
-            call_uuid = None
-            if hasattr(response, 'request_uuid'):
-                call_uuid = response.request_uuid
-            elif hasattr(response, 'call_uuid'):
-                call_uuid = response.call_uuid
-            elif hasattr(response, 'message_uuid'):
-                call_uuid = response.message_uuid
-            elif isinstance(response, dict):
-                call_uuid = response.get('request_uuid') or response.get('call_uuid') or response.get('message_uuid')
-            
-            print(f"Plivo call response: {response}")
-            print(f"Plivo call response type: {type(response)}")
-            if hasattr(response, '__dict__'):
-                print(f"Plivo response attributes: {vars(response)}")
-            
-            # IMPORTANT: Store mapping by phone number as well, since Plivo webhook uses CallUUID
-            # which might be different from request_uuid. We'll store multiple keys.
-            print(f"=== Storing Call Mapping ===")
-            print(f"Phone number: {phone_number}")
-            print(f"SIP URI: {sip_uri}")
-            
-            # Store by phone number (normalized - with and without +)
-            store_call_mapping(phone_number, sip_uri, phone_number)
-            # Also store without + prefix
-            phone_no_plus = phone_number.lstrip('+')
-            store_call_mapping(phone_no_plus, sip_uri, phone_number)
-            
-            # Also store by call UUID if we have it
-            if call_uuid:
-                store_call_mapping(call_uuid, sip_uri, phone_number)
-                print(f"Stored mapping for call_uuid: {call_uuid}")
+            # The SDK returns a response object with request_uuid; also accept
+            # call_uuid or a plain dict
+            call_uuid = (
+                getattr(response, "request_uuid", None)
+                or getattr(response, "call_uuid", None)
+                or (response.get("request_uuid") if isinstance(response, dict) else None)
+            )
             
-            print(f"Stored mapping for phone_number: {phone_number} and {phone_no_plus}")
-            # Import here to avoid circular import
-            from plivo_handlers import call_to_sip_mapping
-            print(f"All stored mappings: {call_to_sip_mapping}")
-            print(f"Plivo call initiated: {response}, CallUUID: {call_uuid}")
+            if app.state.redis is None:
+                # The in-memory store does no I/O, so store inline and let a
+                # failure reach the client
+                await record_call_mapping(call_uuid, room_name, phone_number, sip_uri, response)
+            else:
+                # Writing to Redis doesn't need to hold up the response
+                background_tasks.add_task(finalize_call_mapping, call_uuid, room_name, phone_number, sip_uri, response)
             
         except Exception as e:
             raise HTTPException(
@@ -282,17 +576,6 @@ async def handle_outbound_call(request: Request):
 
 async def create_daily_room():
     """Create a Daily room configured for dial-in"""
-    import aiohttp
-    import certifi
-    
-    # Create SSL context that uses certifi certificates
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {DAILY_API_KEY}"
-    }
-    
     data = {
         "properties": {
             "enable_dialout": True,  # Enable dial-out from within the room
@@ -304,36 +587,20 @@ async def create_daily_room():
         }
     }
     
-    # Create connector with SSL context
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.post(
-            f"{DAILY_API_URL}/rooms",
-            headers=headers,
-            json=data
-        ) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                print(f"Failed to create Daily room: {response.status}")
-                print(await response.text())
-                return None
+    async with app.state.http.post(
+        f"{DAILY_API_URL}/rooms",
+        headers=DAILY_HEADERS,
+        json=data
+    ) as response:
+        if response.status == 200:
+            return await response.json()
+        else:
+            logger.error("Failed to create Daily room: {} {}", response.status, await response.text())
+            return None
 
 
 async def create_daily_token(room_name: str):
     """Create a Daily token for the room"""
-    import aiohttp
-    import certifi
-    
-    # Create SSL context that uses certifi certificates
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {DAILY_API_KEY}"
-    }
-    
     data = {
         "properties": {
             "room_name": room_name,
@@ -341,82 +608,52 @@ async def create_daily_token(room_name: str):
         }
     }
     
-    # Create connector with SSL context
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.post(
-            f"{DAILY_API_URL}/meeting-tokens",
-            headers=headers,
-            json=data
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                return result.get("token")
-            else:
-                error_text = await response.text()
-                print(f"Failed to create token: {response.status}")
-                print(f"Error response: {error_text}")
-                return {"error": f"HTTP {response.status}: {error_text}"}
+    async with app.state.http.post(
+        f"{DAILY_API_URL}/meeting-tokens",
+        headers=DAILY_HEADERS,
+        json=data
+    ) as response:
+        if response.status == 200:
+            result = await response.json()
+            return result.get("token")
+        else:
+            error_text = await response.text()
+            logger.error("Failed to create token: {} {}", response.status, error_text)
+            return {"error": f"HTTP {response.status}: {error_text}"}
+
+
+def sip_uri_from_room(room: dict):
+    """
+    Build the SIP URI from a Daily room object, or return None if the room
+    has no SIP endpoint. Daily provides the full endpoint in config.sip_uri.endpoint,
+    typically in the format: room_name.0@daily-xxx-app.dapp.signalwire.com
+    """
+    sip_endpoint = room.get("config", {}).get("sip_uri", {}).get("endpoint")
+    return f"sip:{sip_endpoint}" if sip_endpoint else None
 
 
 async def get_daily_sip_uri(room_name: str):
     """Get the SIP URI for a Daily room"""
-    import aiohttp
-    import certifi
-    
-    # Create SSL context that uses certifi certificates
-    ssl_context = ssl.create_default_context(cafile=certifi.where())
-    
-    headers = {
-        "Authorization": f"Bearer {DAILY_API_KEY}"
-    }
-    
-    # Create connector with SSL context
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.get(
-            f"{DAILY_API_URL}/rooms/{room_name}",
-            headers=headers
-        ) as response:
-            if response.status == 200:
-                result = await response.json()
-                # Daily SIP URI format for dial-in: sip:room_name@domain.daily.co
-                # Try to get domain from room config, or use default
-                config = result.get("config", {})
-                sip_config = config.get("sip", {})
-                
-                # Extract domain from Daily account (usually in the format: account.daily.co)
-                # For now, use a default format - Daily typically uses: room_name@domain.daily.co
-                # The domain part might be account-specific, but for dial-in it's usually:
-                # sip:room_name@domain.daily.co or sip:room_name@domain
-                
-                # Daily provides the SIP endpoint in config.sip_uri.endpoint
-                config = result.get("config", {})
-                sip_uri_config = config.get("sip_uri", {})
-                sip_endpoint = sip_uri_config.get("endpoint")
-                
-                if sip_endpoint:
-                    # Daily provides the full SIP endpoint, use it directly
-                    # Format is typically: room_name.0@daily-xxx-app.dapp.signalwire.com
-                    sip_uri = f"sip:{sip_endpoint}"
-                    print(f"Using Daily-provided SIP endpoint: {sip_uri}")
-                else:
-                    # Fallback: construct from room name (shouldn't happen if SIP is enabled)
-                    print(f"WARNING: No SIP endpoint found in room config, using fallback")
-                    print(f"Room config: {config}")
-                    sip_uri = f"sip:{room_name}@sip.daily.co"
-                
-                print(f"Room name: {room_name}")
-                print(f"SIP URI config: {sip_uri_config}")
-                print(f"Final SIP URI: {sip_uri}")
-                return sip_uri
+    async with app.state.http.get(
+        f"{DAILY_API_URL}/rooms/{room_name}",
+        headers=DAILY_HEADERS
+    ) as response:
+        if response.status == 200:
+            result = await response.json()
+            sip_uri = sip_uri_from_room(result)
+            
+            if sip_uri:
+                logger.debug("Using Daily-provided SIP endpoint: {}", sip_uri)
             else:
-                error_text = await response.text()
-                print(f"Failed to get room info: {response.status}")
-                print(f"Error response: {error_text}")
-                return None
+                # Fallback: construct from room name (shouldn't happen if SIP is enabled)
+                logger.warning("No SIP endpoint found in room config, using fallback. Room config: {}", result.get("config"))
+                sip_uri = f"sip:{room_name}@sip.daily.co"
+            
+            return sip_uri
+        else:
+            error_text = await response.text()
+            logger.error("Failed to get room info: {} {}", response.status, error_text)
+            return None
 
 
 if __name__ == "__main__":
@@ -425,13 +662,36 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Daily Direct Dial-out Server")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Host to bind to")
     parser.add_argument("--port", type=int, default=8000, help="Port to bind to")
-    parser.add_argument("--reload", action="store_true", help="Enable auto-reload")
+    parser.add_argument("--reload", action="store_true", help="Enable auto-reload (runs a single worker)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: CPU count with REDIS_URL set, otherwise 1)"
+    )
     
     args = parser.parse_args()
     
+    if args.reload and (args.workers or 1) > 1:
+        parser.error("--reload and --workers are mutually exclusive")
+    
+    # Workers only share call mappings through Redis
+    workers = args.workers or ((os.cpu_count() or 2) if REDIS_URL else 1)
+    if workers > 1 and not REDIS_URL:
+        logger.warning("Running {} workers without REDIS_URL; call mappings won't be shared", workers)
+    if workers > 1 and BOT_MODE == "subprocess":
+        logger.warning("Bot readiness callbacks may reach a different worker; calls can wait the full {}s", BOT_READY_TIMEOUT)
+    
     uvicorn.run(
         "server:app",
         host=args.host,
         port=args.port,
-        reload=args.reload
+        reload=args.reload,
+        workers=None if args.reload else workers,
+        # "auto" picks uvloop and httptools when uvicorn[standard] installed
+        # them, and falls back to asyncio/h11 where it didn't (e.g. Windows)
+        loop="auto",
+        http="auto",
+        timeout_keep_alive=30,
+        limit_concurrency=1000
     )
\ No newline at end of file